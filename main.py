@@ -1,18 +1,28 @@
 import asyncio
+import gc
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import logging.handlers
+import queue
+from typing import Deque, Dict, List, Literal, Optional, Set, Tuple
 import os
 import random
+import heapq
+import math
+import time
+from collections import OrderedDict, deque
 from dataclasses import dataclass
 
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.enums import ChatMemberStatus, ContentType
-from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
-from aiogram.filters import Command, CommandStart, ChatMemberUpdatedFilter, IS_MEMBER, IS_NOT_MEMBER
+from aiogram.enums import ContentType
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
+from aiogram.filters import Filter, Command, CommandStart
 from aiogram.filters.callback_data import CallbackData
-from aiogram.types import ChatMemberUpdated, InlineKeyboardMarkup, InlineKeyboardButton, ChatPermissions, PollAnswer, User
-from aiohttp import web
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ChatPermissions, PollAnswer, User
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import ClientConnectorError, web
+import orjson
+from aiolimiter import AsyncLimiter
 
 @dataclass
 class Config:
@@ -27,6 +37,20 @@ class Config:
     verification_timeout: int = 300  # 5 минут
     message_cleanup_time: int = 600  # 10 минут
     ban_notification_time: int = 180  # 3 минуты
+    maintenance_interval: int = 60  # Период фоновой очистки кэшей
+
+    admin_cache_ttl: int = 300  # Время жизни кэша списка админов чата
+    admin_cache_size: int = 1024  # Максимум чатов в кэше
+
+    max_tracked_users: int = 5000  # Лимит записей о пользователях в памяти
+    max_messages_per_user: int = 200  # Лимит отслеживаемых сообщений одного пользователя
+
+    global_rate_limit: int = 25  # Запросов к Bot API в секунду суммарно
+    chat_rate_limit: int = 1  # Сообщений в секунду в один чат
+
+    api_connection_limit: int = 100  # Размер пула соединений к Bot API
+    api_connections_per_host: int = 64
+    api_keepalive_timeout: int = 75  # Сколько секунд держать простаивающее соединение
 
     htest_enabled_default: bool = True
     fastout_enabled_default: bool = True
@@ -57,36 +81,177 @@ DEFAULT_PERMISSIONS = ChatPermissions(
     can_add_web_page_previews=True,
 )
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Максимум ID сообщений в одном вызове deleteMessages
+DELETE_MESSAGES_BATCH = 100
+
+# Варианты ответа для опроса верификации
+CORRECT_ANSWER = "Я не спамер"
+SPAM_OPTIONS: Tuple[str, ...] = (
+    "Я спам-бот и горжусь этим",
+    "Отправляю спам 24/7",
+    "Спам - это моя профессия",
+    "Реклама казино - мое призвание",
+    "Продаю крипто-курсы",
+    "Млм-маркетолог со стажем",
+    "Фейковые новости - мой хлеб",
+    "Накрутчик подписчиков",
+    "Бот для рассылки рекламы"
 )
+
 logger = logging.getLogger(__name__)
 
+def setup_logging() -> logging.handlers.QueueListener:
+    """Настройка логирования: обработчики только кладут записи в очередь,
+    а запись в stderr выполняет отдельный поток QueueListener, не блокируя цикл событий"""
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
 # CallbackData для кнопок администратора
 class AdminAction(CallbackData, prefix="admin"):
-    action: str  # "approve" or "reject"
+    action: Literal["approve", "reject"]  # Прочие значения отсекаются фильтром ещё до вызова обработчика
     user_id: int
 
 class IgnoreCallback(CallbackData, prefix="ignore"):
     pass  # Данные не нужны, просто для фильтра
 
+# У IgnoreCallback нет полей, поэтому упакованная строка всегда одна и та же
+IGNORE_CALLBACK_DATA = IgnoreCallback().pack()
+
+class TelegramSession(AiohttpSession):
+    """Сессия Bot API с тёплым пулом keep-alive соединений к api.telegram.org,
+    чтобы всплески запросов не тратили время на новые TCP/TLS-рукопожатия"""
+    # Повторы запросов: один после 429 (если ждать недолго) и несколько после сетевых ошибок
+    max_retry_after = 60
+    network_retries = 3
+    max_backoff = 30
+    # Методы, повтор которых безопасен, даже если первый запрос успел выполниться на стороне Telegram.
+    # Отправку сообщений и опросов повторяем только если соединение не удалось установить
+    idempotent_methods = frozenset({
+        "restrictChatMember", "banChatMember", "unbanChatMember",
+        "deleteMessage", "deleteMessages", "editMessageReplyMarkup",
+        "getChatAdministrators", "getWebhookInfo", "setWebhook", "deleteWebhook"
+    })
+
+    def __init__(self, limit_per_host: int, keepalive_timeout: int, **kwargs):
+        super().__init__(**kwargs)
+        self._connector_init.update(
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            force_close=False
+        )
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None):
+        """Запрос к Bot API с соблюдением retry_after и повтором при сетевых ошибках"""
+        retried_after_limit = False
+        network_attempt = 0
+        while True:
+            try:
+                return await super().make_request(bot, method, timeout)
+            except TelegramRetryAfter as e:
+                if retried_after_limit or e.retry_after > self.max_retry_after:
+                    raise
+                retried_after_limit = True
+                # Случайная добавка не даёт всем отложенным запросам повториться одновременно
+                delay = e.retry_after + random.random()
+                logger.warning("Лимит запросов Bot API на %s, повтор через %.1f с", method.__api_method__, delay)
+            except TelegramNetworkError as e:
+                if network_attempt >= self.network_retries:
+                    raise
+                # aiogram поднимает TelegramNetworkError внутри except, исходная ошибка aiohttp лежит в __context__
+                if method.__api_method__ not in self.idempotent_methods and not isinstance(e.__context__, ClientConnectorError):
+                    raise
+                delay = min(2 ** network_attempt, self.max_backoff) + random.random()
+                network_attempt += 1
+                logger.warning("Сетевая ошибка при вызове %s: %s, повтор через %.1f с", method.__api_method__, e, delay)
+            await asyncio.sleep(delay)
+
+class MechanismActiveFilter(Filter):
+    """Пропускает сообщение, только если включён HTest или FastOut"""
+    async def __call__(self, message: types.Message, bot_instance: "VerificationBot") -> bool:
+        return bot_instance.htest_enabled or bot_instance.fastout_enabled
+
+def orjson_dumps(obj) -> str:
+    """json.dumps-совместимая сериализация через orjson"""
+    return orjson.dumps(obj).decode("utf-8")
+
+def format_timer(seconds: int) -> str:
+    """Текст кнопки-таймера в формате ⏳ ММ:СС"""
+    minutes, seconds = divmod(seconds, 60)
+    return f"⏳ {minutes:02d}:{seconds:02d}"
+
+def build_admin_buttons(user_id: int) -> Tuple[InlineKeyboardButton, InlineKeyboardButton]:
+    """Кнопки одобрения и отклонения, которые не меняются за время верификации"""
+    return (
+        InlineKeyboardButton(text="👍", callback_data=AdminAction(action="approve", user_id=user_id).pack()),
+        InlineKeyboardButton(text="👎", callback_data=AdminAction(action="reject", user_id=user_id).pack())
+    )
+
+def build_verification_keyboard(approve_button: InlineKeyboardButton, reject_button: InlineKeyboardButton,
+                                timer_text: str) -> InlineKeyboardMarkup:
+    """Клавиатура под опросом: одобрить / таймер / отклонить"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [approve_button, InlineKeyboardButton(text=timer_text, callback_data=IGNORE_CALLBACK_DATA), reject_button]
+    ])
+
+@dataclass(slots=True)
+class PendingVerification:
+    """Данные пользователя, проходящего верификацию"""
+    chat_id: int
+    poll_id: str
+    message_id: int
+    correct_option_id: int
+    deadline: float  # По часам time.monotonic()
+    user: User
+    # Кнопки админа строятся один раз, при обновлении таймера меняется только средняя кнопка
+    approve_button: InlineKeyboardButton
+    reject_button: InlineKeyboardButton
+    last_shown_minute: int = -1  # Минута, показанная на кнопке-таймере
+    scheduled_minute: int = 0  # Минута, на смену которой запланировано обновление кнопки-таймера
+
 # Класс бота
 class VerificationBot:
     def __init__(self, config: Config):
         self.config = config
-        self.bot = Bot(token=self.config.bot_token)
+        # orjson разбирает и тела вебхуков (SimpleRequestHandler берёт json_loads из сессии), и ответы Bot API
+        session = TelegramSession(
+            limit=self.config.api_connection_limit,
+            limit_per_host=self.config.api_connections_per_host,
+            keepalive_timeout=self.config.api_keepalive_timeout,
+            json_loads=orjson.loads,
+            json_dumps=orjson_dumps
+        )
+        self.bot = Bot(token=self.config.bot_token, session=session)
         self.dp = Dispatcher()
-        self.pending_verifications: Dict[int, Dict] = {}  # user_id -> verification_data
-        self.user_messages: Dict[int, List[int]] = {}    # user_id -> [message_ids]
+        self.pending_verifications: OrderedDict[int, PendingVerification] = OrderedDict()  # user_id -> verification_data
+        self.user_messages: OrderedDict[int, Deque[Tuple[int, float]]] = OrderedDict()  # user_id -> (message_id, time.monotonic())
         self.ban_notifications: Dict[int, int] = {}      # chat_id -> message_id
+        # Отложенные задачи: (срок по time.monotonic(), вид, chat_id/user_id, message_id)
+        self._timer_heap: List[Tuple[float, str, int, int]] = []
+        self._timer_wakeup = asyncio.Event()
+        self._admin_cache: Dict[int, Tuple[Set[int], float]] = {}  # chat_id -> (admin_ids, expires_at)
+        self._global_limiter = AsyncLimiter(self.config.global_rate_limit, 1)
+        self._chat_limiters: Dict[int, AsyncLimiter] = {}  # chat_id -> limiter
+        self._background_tasks: Set[asyncio.Task] = set()  # Ссылки на фоновые задачи, чтобы их не собрал GC
+        self._timer_task: Optional[asyncio.Task] = None  # Обработчик отложенных задач, живёт от запуска до остановки
+        self._restrict_tasks: Dict[int, asyncio.Task] = {}  # user_id -> ограничение прав, наложенное при входе
         self.htest_enabled = self.config.htest_enabled_default
         self.fastout_enabled = self.config.fastout_enabled_default
         self.setup_handlers()
 
     def setup_handlers(self):
         """Настройка обработчиков событий"""
+        # Экземпляр бота доступен фильтрам и обработчикам через workflow_data
+        self.dp["bot_instance"] = self
+        self.dp.startup.register(self.on_startup)
+        self.dp.shutdown.register(self.on_shutdown)
+
         # Надежная обработка входа и выхода через служебные сообщения
         self.dp.message(F.new_chat_members)(self.on_new_chat_members)
         self.dp.message(F.left_chat_member)(self.on_left_chat_member)
@@ -109,17 +274,40 @@ class VerificationBot:
                 ContentType.TEXT, ContentType.PHOTO, ContentType.VIDEO,
                 ContentType.DOCUMENT, ContentType.AUDIO, ContentType.VOICE,
                 ContentType.STICKER, ContentType.ANIMATION
-            })
+            }),
+            MechanismActiveFilter()  # При выключенных механизмах обработчик не вызывается вовсе
         )(self.handle_message_from_new_member)
 
+    async def on_startup(self):
+        """Запуск обработчика таймеров и установка вебхука при запуске"""
+        self.start_timers()
+        try:
+            await self.bot.delete_webhook(drop_pending_updates=True)
+            # Подписываемся только на те типы обновлений, для которых есть обработчики
+            await self.bot.set_webhook(self.config.webhook_url, allowed_updates=self.dp.resolve_used_update_types())
+            logger.info("Вебхук установлен: %s", self.config.webhook_url)
+            webhook_info = await self.bot.get_webhook_info()
+            logger.info("Информация о вебхуке: %s", webhook_info)
+        except Exception as e:
+            logger.error("Ошибка установки вебхука: %s", e)
+
+    async def on_shutdown(self):
+        """Остановка обработчика таймеров и удаление вебхука при остановке (сессию бота закрывает SimpleRequestHandler)"""
+        await self.stop_timers()
+        try:
+            await self.bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Бот остановлен, вебхук удалён")
+        except Exception as e:
+            logger.error("Ошибка при остановке: %s", e)
+
     async def start_command(self, message: types.Message):
         """Обработчик команды /start"""
-        logger.info(f"Получена команда /start от {message.from_user.id} в чате {message.chat.id}")
+        logger.info("Получена команда /start от %s в чате %s", message.from_user.id, message.chat.id)
         try:
-            await message.reply("Привет! Я бот для верификации пользователей. Мои настройки можно посмотреть по команде /status.")
-            logger.info(f"Ответ на /start отправлен в чат {message.chat.id}")
+            await self._send(message.chat.id, message.reply, "Привет! Я бот для верификации пользователей. Мои настройки можно посмотреть по команде /status.")
+            logger.info("Ответ на /start отправлен в чат %s", message.chat.id)
         except TelegramAPIError as e:
-            logger.error(f"Ошибка при отправке ответа на /start в чат {message.chat.id}: {e}")
+            logger.error("Ошибка при отправке ответа на /start в чат %s: %s", message.chat.id, e)
 
     async def on_new_chat_members(self, message: types.Message):
         """Обработка входа нового участника через сервисное сообщение."""
@@ -130,48 +318,44 @@ class VerificationBot:
             if user.id == self.bot.id:
                 continue
 
-            logger.info(f"Новый участник {user.id} ({user.full_name}) в чате {message.chat.id}")
+            logger.info("Новый участник %s (%s) в чате %s", user.id, user.full_name, message.chat.id)
+            # Ограничение прав и отправка опроса не зависят друг от друга, выполняем их параллельно.
+            # Задачу ограничения запоминаем: снятие ограничений должно дождаться её, иначе запоздавший
+            # запрос (например, повтор после сетевой ошибки) снова лишит одобренного пользователя прав
+            restrict_task = self._restrict_tasks[user.id] = asyncio.create_task(
+                self._call(self.bot.restrict_chat_member, chat_id=message.chat.id, user_id=user.id, permissions=RESTRICTED_PERMISSIONS)
+            )
             try:
-                await self.bot.restrict_chat_member(chat_id=message.chat.id, user_id=user.id, permissions=RESTRICTED_PERMISSIONS)
-                await self.create_verification_poll(message.chat.id, user)
-            except TelegramAPIError as e:
-                logger.error(f"Ошибка при ограничении прав пользователя {user.id}: {e}")
-        await message.delete() # Удаляем сообщение "User joined"
+                restrict_result, poll_result = await asyncio.gather(
+                    restrict_task,
+                    self.create_verification_poll(message.chat.id, user),
+                    return_exceptions=True
+                )
+            finally:
+                if self._restrict_tasks.get(user.id) is restrict_task:
+                    del self._restrict_tasks[user.id]
+            if isinstance(restrict_result, Exception):
+                logger.error("Ошибка при ограничении прав пользователя %s: %s", user.id, restrict_result)
+            if isinstance(poll_result, Exception):
+                logger.error("Ошибка при создании опроса для пользователя %s: %s", user.id, poll_result)
+        return message.delete() # Удаляем сообщение "User joined" ответом на вебхук
         
     async def create_verification_poll(self, chat_id: int, user: User):
         """Создание опроса для верификации"""
         username = user.username or user.first_name or "Новый участник"
         poll_question = f"Приветствуем тебя, {username}({user.url})\nОтветь на вопрос или покинь группу"
 
-        poll_options_all = [
-            "Я спам-бот и горжусь этим",
-            "Отправляю спам 24/7",
-            "Спам - это моя профессия",
-            "Реклама казино - мое призвание",
-            "Продаю крипто-курсы",
-            "Млм-маркетолог со стажем",
-            "Фейковые новости - мой хлеб",
-            "Накрутчик подписчиков",
-            "Бот для рассылки рекламы"
-        ]
-        correct_answer = "Я не спамер"
-        wrong_answers = random.sample(poll_options_all, 2)
-        poll_options = wrong_answers + [correct_answer]
-        random.shuffle(poll_options)
-        correct_option_id = poll_options.index(correct_answer)
-
-        minutes, seconds = divmod(self.config.verification_timeout, 60)
-        timer_text = f"⏳ {minutes:02d}:{seconds:02d}"
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="👍", callback_data=AdminAction(action="approve", user_id=user.id).pack()),
-                InlineKeyboardButton(text=timer_text, callback_data=IgnoreCallback().pack()),
-                InlineKeyboardButton(text="👎", callback_data=AdminAction(action="reject", user_id=user.id).pack())
-            ]
-        ])
+        poll_options = random.sample(SPAM_OPTIONS, 2)
+        correct_option_id = random.randint(0, len(poll_options))
+        poll_options.insert(correct_option_id, CORRECT_ANSWER)
+
+        approve_button, reject_button = build_admin_buttons(user.id)
+        keyboard = build_verification_keyboard(approve_button, reject_button, format_timer(self.config.verification_timeout))
 
         try:
-            poll_message = await self.bot.send_poll(
+            poll_message = await self._send(
+                chat_id,
+                self.bot.send_poll,
                 chat_id=chat_id,
                 question=poll_question,
                 options=poll_options,
@@ -180,35 +364,37 @@ class VerificationBot:
                 reply_markup=keyboard
             )
 
-            self.pending_verifications[user.id] = {
-                "chat_id": chat_id,
-                "poll_id": poll_message.poll.id,
-                "message_id": poll_message.message_id,
-                "correct_option_id": correct_option_id,
-                "deadline": datetime.now() + timedelta(seconds=self.config.verification_timeout),
-                "user": user
-            }
-            # Запускаем и таймер на удаление, и таймер на обновление кнопки
-            asyncio.create_task(self.verification_timeout(user.id))
-            asyncio.create_task(self.update_timer_display(user.id))
-            logger.info(f"Создан опрос для пользователя {user.id} в чате {chat_id}")
+            verification_data = self.pending_verifications[user.id] = PendingVerification(
+                chat_id=chat_id,
+                poll_id=poll_message.poll.id,
+                message_id=poll_message.message_id,
+                correct_option_id=correct_option_id,
+                deadline=time.monotonic() + self.config.verification_timeout,
+                user=user,
+                approve_button=approve_button,
+                reject_button=reject_button
+                # last_shown_minute остаётся -1: начальный текст кнопки не совпадает с границей минуты,
+                # если таймаут не кратен 60, поэтому первое обновление пропускать нельзя
+            )
+            self._touch(self.pending_verifications, user.id, self._on_verification_evicted)
+            # Ставим таймер на исключение и на обновление кнопки
+            self.schedule(self.config.verification_timeout, "verify", user.id, poll_message.message_id)
+            self.schedule_timer_update(user.id, verification_data)
+            logger.info("Создан опрос для пользователя %s в чате %s", user.id, chat_id)
         except TelegramAPIError as e:
-            logger.error(f"Ошибка при создании опроса для пользователя {user.id}: {e}")
+            logger.error("Ошибка при создании опроса для пользователя %s: %s", user.id, e)
 
     async def handle_poll_answer(self, poll_answer: PollAnswer):
         """Обработка ответа на опрос"""
         user = poll_answer.user
-        if user.id not in self.pending_verifications:
-            return
-
-        verification_data = self.pending_verifications[user.id]
-        if poll_answer.poll_id != verification_data["poll_id"]:
+        verification_data = self.pending_verifications.get(user.id)
+        if verification_data is None or poll_answer.poll_id != verification_data.poll_id:
             return
 
         selected_option_id = poll_answer.option_ids[0]
-        logger.info(f"Пользователь {user.id} ответил на опрос, выбрав опцию {selected_option_id}")
+        logger.info("Пользователь %s ответил на опрос, выбрав опцию %s", user.id, selected_option_id)
 
-        if selected_option_id == verification_data["correct_option_id"]:
+        if selected_option_id == verification_data.correct_option_id:
             await self.approve_user(user.id)
         else:
             await self.reject_user(user.id, "Неправильный ответ на опрос")
@@ -225,22 +411,22 @@ class VerificationBot:
         if user_id not in self.pending_verifications:
             await callback.answer("Этот пользователь уже прошел верификацию или был исключен.", show_alert=True)
             try:
-                await callback.message.edit_reply_markup(reply_markup=None)
+                await self._call(callback.message.edit_reply_markup, reply_markup=None)
             except Exception as e:
-                logger.warning(f"Не удалось убрать кнопки у сообщения {callback.message.message_id}: {e}")
+                logger.warning("Не удалось убрать кнопки у сообщения %s: %s", callback.message.message_id, e)
             return
 
-        logger.info(f"Админ {callback.from_user.id} выполнил действие {action} для пользователя {user_id}")
+        logger.info("Админ %s выполнил действие %s для пользователя %s", callback.from_user.id, action, user_id)
 
         try:
             if action == "approve":
                 await self.approve_user(user_id)
                 await callback.answer("Пользователь одобрен")
-            elif action == "reject":
+            else:
                 await self.reject_user(user_id, "Отклонен администратором")
                 await callback.answer("Пользователь отклонен")
         except TelegramAPIError as e:
-            logger.error(f"Ошибка при обработке реакции {action} для пользователя {user_id}: {e}")
+            logger.error("Ошибка при обработке реакции %s для пользователя %s: %s", action, user_id, e)
 
     async def approve_user(self, user_id: int):
         """Одобрение пользователя"""
@@ -248,19 +434,33 @@ class VerificationBot:
         if not verification_data:
             return
 
-        chat_id = verification_data["chat_id"]
+        chat_id = verification_data.chat_id
 
         try:
-            await self.bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=DEFAULT_PERMISSIONS)
-            await self.bot.delete_message(chat_id=chat_id, message_id=verification_data["message_id"])
-            await self.bot.send_message(
+            await self.lift_restrictions(chat_id, user_id)
+        except TelegramAPIError as e:
+            logger.error("Ошибка при снятии ограничений с пользователя %s: %s", user_id, e)
+            # Опрос и кнопки остаются на месте, поэтому возвращаем запись, чтобы админ мог повторить одобрение
+            self.pending_verifications[user_id] = verification_data
+            self._touch(self.pending_verifications, user_id, self._on_verification_evicted)
+            return
+
+        # Удаление опроса и поздравление не зависят друг от друга
+        results = await asyncio.gather(
+            self._call(self.bot.delete_message, chat_id=chat_id, message_id=verification_data.message_id),
+            self._send(
+                chat_id,
+                self.bot.send_message,
                 chat_id=chat_id,
-                text=f"✅ {verification_data['user'].first_name} успешно прошел верификацию!",
+                text=f"✅ {verification_data.user.first_name} успешно прошел верификацию!",
                 disable_notification=True
-            )
-            logger.info(f"Пользователь {user_id} одобрен в чате {chat_id}")
-        except TelegramAPIError as e:
-            logger.error(f"Ошибка при одобрении пользователя {user_id}: {e}")
+            ),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Ошибка при одобрении пользователя %s: %s", user_id, result)
+        logger.info("Пользователь %s одобрен в чате %s", user_id, chat_id)
 
     async def reject_user(self, user_id: int, reason: str):
         """Отклонение пользователя"""
@@ -268,80 +468,236 @@ class VerificationBot:
         if not verification_data:
             return
 
-        chat_id = verification_data["chat_id"]
-        user = verification_data["user"]
+        chat_id = verification_data.chat_id
+        user = verification_data.user
 
         try:
-            await self.bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
-            await self.bot.unban_chat_member(chat_id=chat_id, user_id=user_id)
-            await self.bot.delete_message(chat_id=chat_id, message_id=verification_data["message_id"])
-            ban_message = await self.bot.send_message(
+            await self._call(self.bot.ban_chat_member, chat_id=chat_id, user_id=user_id)
+        except TelegramAPIError as e:
+            logger.error("Ошибка при исключении пользователя %s: %s", user_id, e)
+            return
+
+        # Разбан нужен лишь для того, чтобы пользователь мог вернуться позже, его результат не ждём
+        self._spawn(self._call(self.bot.unban_chat_member, chat_id=chat_id, user_id=user_id))
+        delete_result, ban_message = await asyncio.gather(
+            self._call(self.bot.delete_message, chat_id=chat_id, message_id=verification_data.message_id),
+            self._send(
+                chat_id,
+                self.bot.send_message,
                 chat_id=chat_id,
                 text=f"🚫 {user.first_name} исключен из группы. Причина: {reason}",
                 disable_notification=True
-            )
+            ),
+            return_exceptions=True
+        )
+        if isinstance(delete_result, Exception):
+            logger.error("Ошибка при удалении опроса пользователя %s: %s", user_id, delete_result)
+        if isinstance(ban_message, Exception):
+            logger.error("Ошибка при отправке уведомления об исключении пользователя %s: %s", user_id, ban_message)
+        else:
             self.ban_notifications[chat_id] = ban_message.message_id
-            asyncio.create_task(self.remove_ban_notification(chat_id, ban_message.message_id))
-            logger.info(f"Пользователь {user_id} исключен из чата {chat_id}: {reason}")
-        except TelegramAPIError as e:
-            logger.error(f"Ошибка при исключении пользователя {user_id}: {e}")
+            self.schedule(self.config.ban_notification_time, "ban_notice", chat_id, ban_message.message_id)
+        logger.info("Пользователь %s исключен из чата %s: %s", user_id, chat_id, reason)
+
+    async def lift_restrictions(self, chat_id: int, user_id: int):
+        """Снятие ограничений после того, как завершится ограничение прав, наложенное при входе"""
+        restrict_task = self._restrict_tasks.get(user_id)
+        if restrict_task is not None:
+            await asyncio.wait([restrict_task])  # Ошибку ограничения логирует on_new_chat_members
+        await self._call(self.bot.restrict_chat_member, chat_id=chat_id, user_id=user_id, permissions=DEFAULT_PERMISSIONS)
+
+    async def _call(self, coro_fn, /, *args, **kwargs):
+        """Вызов метода Bot API с учётом глобального лимита запросов"""
+        async with self._global_limiter:
+            return await coro_fn(*args, **kwargs)
+
+    async def _send(self, chat_id: int, coro_fn, /, *args, **kwargs):
+        """Отправка сообщения в чат с учётом глобального лимита и лимита на чат"""
+        chat_limiter = self._chat_limiters.get(chat_id)
+        if chat_limiter is None:
+            chat_limiter = self._chat_limiters[chat_id] = AsyncLimiter(self.config.chat_rate_limit, 1)
+        # Сначала ждём лимита чата, чтобы очередь в один чат не занимала общую квоту запросов
+        async with chat_limiter, self._global_limiter:
+            return await coro_fn(*args, **kwargs)
+
+    def _spawn(self, coro):
+        """Запуск фоновой задачи без ожидания результата"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_task_done)
+
+    def _on_background_task_done(self, task: asyncio.Task):
+        """Освобождение ссылки на фоновую задачу и логирование её ошибки"""
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Ошибка в фоновой задаче: %s", task.exception())
+
+    def _touch(self, store: OrderedDict, user_id: int, on_evict=None):
+        """Помечает запись как свежую и вытесняет самые старые записи сверх лимита"""
+        store.move_to_end(user_id)
+        while len(store) > self.config.max_tracked_users:
+            evicted_id, evicted = store.popitem(last=False)
+            logger.debug("Достигнут лимит отслеживаемых пользователей, запись %s вытеснена", evicted_id)
+            if on_evict is not None:
+                on_evict(evicted_id, evicted)
+
+    def _on_verification_evicted(self, user_id: int, verification_data: PendingVerification):
+        """Вытесненного из памяти пользователя нельзя оставлять без прав: снимаем ограничения и убираем опрос"""
+        logger.warning("Верификация пользователя %s в чате %s прервана из-за лимита, ограничения сняты",
+                       user_id, verification_data.chat_id)
+        self._spawn(self.release_evicted_user(user_id, verification_data))
+
+    async def release_evicted_user(self, user_id: int, verification_data: PendingVerification):
+        """Снятие ограничений и удаление опроса пользователя, вытесненного из очереди верификации"""
+        chat_id = verification_data.chat_id
+        results = await asyncio.gather(
+            self.lift_restrictions(chat_id, user_id),
+            self._call(self.bot.delete_message, chat_id=chat_id, message_id=verification_data.message_id),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Ошибка при освобождении вытесненного пользователя %s: %s", user_id, result)
+
+    def start_timers(self):
+        """Запуск обработчика отложенных задач"""
+        if self._timer_task is None:
+            self._timer_task = asyncio.create_task(self._timer_worker())
+
+    async def stop_timers(self):
+        """Остановка обработчика отложенных задач; повторный вызов ничего не делает"""
+        timer_task, self._timer_task = self._timer_task, None
+        if timer_task is None:
+            return
+        timer_task.cancel()
+        try:
+            await timer_task
+        except asyncio.CancelledError:
+            pass
+
+    def schedule(self, delay: float, kind: str, target_id: int, message_id: int):
+        """Постановка отложенной задачи в очередь таймеров"""
+        heapq.heappush(self._timer_heap, (time.monotonic() + delay, kind, target_id, message_id))
+        self._timer_wakeup.set()
+
+    async def _timer_worker(self):
+        """Единый обработчик отложенных задач вместо отдельной корутины на каждого пользователя"""
+        self.schedule(self.config.maintenance_interval, "maintenance", 0, 0)
+        while True:
+            delay = self._timer_heap[0][0] - time.monotonic() if self._timer_heap else None
+            if delay is None or delay > 0:
+                self._timer_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._timer_wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
 
-    async def verification_timeout(self, user_id: int):
-        """Таймер верификации"""
-        await asyncio.sleep(self.config.verification_timeout)
-        if user_id in self.pending_verifications:
-            await self.reject_user(user_id, "Превышено время верификации")
+            _, kind, target_id, message_id = heapq.heappop(self._timer_heap)
+            try:
+                await self._fire_timer(kind, target_id, message_id)
+            except Exception as e:
+                logger.error("Ошибка при выполнении отложенной задачи %s для %s: %s", kind, target_id, e)
+
+    async def _fire_timer(self, kind: str, target_id: int, message_id: int):
+        """Выполнение сработавшей отложенной задачи"""
+        if kind == "verify":
+            # Проверяем, что таймер относится к текущему опросу, а не к прошлому входу пользователя
+            verification_data = self.pending_verifications.get(target_id)
+            if verification_data and verification_data.message_id == message_id:
+                # Бан и уведомление ждут лимитов запросов, поэтому не задерживаем остальные таймеры
+                self._spawn(self.reject_user(target_id, "Превышено время верификации"))
+        elif kind == "timer":
+            verification_data = self.pending_verifications.get(target_id)
+            if verification_data and verification_data.message_id == message_id:
+                # Правка кнопки ждёт лимита на чат, поэтому не задерживаем остальные таймеры
+                self._spawn(self.update_timer_display(target_id))
+        elif kind == "ban_notice":
+            self._spawn(self.remove_ban_notification(target_id, message_id))
+        elif kind == "maintenance":
+            self.prune_caches()
+            self.schedule(self.config.maintenance_interval, "maintenance", 0, 0)
+
+    def prune_caches(self):
+        """Удаление устаревших записей из кэша админов, истории сообщений FastOut и простаивающих лимитеров чатов"""
+        now = time.monotonic()
+        expire_before = now - self.config.message_cleanup_time
+        for user_id in list(self.user_messages):
+            messages = self.user_messages[user_id]
+            while messages and messages[0][1] <= expire_before:
+                messages.popleft()
+            if not messages:
+                del self.user_messages[user_id]
+
+        for chat_id in [chat_id for chat_id, (_, expires_at) in self._admin_cache.items() if expires_at <= now]:
+            del self._admin_cache[chat_id]
+        # Словарь хранит порядок вставки, поэтому первыми удаляются самые старые записи
+        while len(self._admin_cache) > self.config.admin_cache_size:
+            del self._admin_cache[next(iter(self._admin_cache))]
+
+        # Лимитер, полностью восстановивший квоту, ничем не отличается от нового, поэтому его можно удалить
+        for chat_id in [chat_id for chat_id, limiter in self._chat_limiters.items() if limiter.has_capacity(limiter.max_rate)]:
+            del self._chat_limiters[chat_id]
 
     async def remove_ban_notification(self, chat_id: int, message_id: int):
         """Удаление уведомления о бане"""
-        await asyncio.sleep(self.config.ban_notification_time)
         try:
-            await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            await self._call(self.bot.delete_message, chat_id=chat_id, message_id=message_id)
             self.ban_notifications.pop(chat_id, None)
-            logger.debug(f"Уведомление о бане удалено в чате {chat_id}")
+            logger.debug("Уведомление о бане удалено в чате %s", chat_id)
         except TelegramAPIError as e:
-            logger.error(f"Ошибка при удалении уведомления о бане: {e}")
+            logger.error("Ошибка при удалении уведомления о бане: %s", e)
+
+    def schedule_timer_update(self, user_id: int, verification_data: PendingVerification):
+        """Планирование обновления кнопки-таймера на момент смены отображаемой минуты"""
+        remaining = verification_data.deadline - time.monotonic()
+        next_minute = math.ceil(remaining / 60) - 1
+        if next_minute <= 0:
+            return  # Дальше опрос закроет таймер верификации
+        verification_data.scheduled_minute = next_minute
+        self.schedule(remaining - next_minute * 60, "timer", user_id, verification_data.message_id)
 
     async def update_timer_display(self, user_id: int):
         """Обновляет таймер на кнопке в сообщении с опросом."""
-        while user_id in self.pending_verifications:
-            try:
-                verification_data = self.pending_verifications.get(user_id)
-                if not verification_data:
-                    break
-
-                deadline = verification_data["deadline"]
-                remaining_seconds = int((deadline - datetime.now()).total_seconds())
-
-                if remaining_seconds <= 0:
-                    break
-
-                minutes, seconds = divmod(remaining_seconds, 60)
-                timer_text = f"⏳ {minutes:02d}:{seconds:02d}"
-
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [
-                        InlineKeyboardButton(text="👍", callback_data=AdminAction(action="approve", user_id=user_id).pack()),
-                        InlineKeyboardButton(text=timer_text, callback_data=IgnoreCallback().pack()),
-                        InlineKeyboardButton(text="👎", callback_data=AdminAction(action="reject", user_id=user_id).pack())
-                    ]
-                ])
-
-                await self.bot.edit_message_reply_markup(
-                    chat_id=verification_data["chat_id"],
-                    message_id=verification_data["message_id"],
-                    reply_markup=keyboard
+        verification_data = self.pending_verifications.get(user_id)
+        if not verification_data:
+            return
+
+        # Показываем ту минуту, на которую было запланировано обновление: если таймер сработал
+        # с опозданием, пересчёт по текущему времени показал бы 03:59 и пропустил бы следующую границу
+        shown_minute = verification_data.scheduled_minute
+        if shown_minute <= 0 or shown_minute == verification_data.last_shown_minute:
+            self.schedule_timer_update(user_id, verification_data)
+            return
+
+        # Обновление таймера косметическое: если квота чата уже занята опросами и уведомлениями,
+        # пропускаем его, а не ставим в очередь, где текст устареет к моменту отправки
+        chat_limiter = self._chat_limiters.get(verification_data.chat_id)
+        if chat_limiter is not None and not chat_limiter.has_capacity():
+            self.schedule_timer_update(user_id, verification_data)
+            return
+
+        try:
+            await self._send(
+                verification_data.chat_id,
+                self.bot.edit_message_reply_markup,
+                chat_id=verification_data.chat_id,
+                message_id=verification_data.message_id,
+                reply_markup=build_verification_keyboard(
+                    verification_data.approve_button,
+                    verification_data.reject_button,
+                    format_timer(shown_minute * 60)
                 )
-                await asyncio.sleep(10)
-            except TelegramBadRequest as e:
-                if "message is not modified" in e.message:
-                    await asyncio.sleep(10)  # Ошибка ожидаемая, просто продолжаем
-                else:
-                    raise  # Другая, неожиданная ошибка
-            except TelegramAPIError as e:
-                logger.warning(f"Не удалось обновить таймер для {user_id} (возможно, сообщение удалено): {e}")
-                break
-        logger.debug(f"Таймер для пользователя {user_id} остановлен.")
+            )
+            verification_data.last_shown_minute = shown_minute
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message:
+                logger.warning("Не удалось обновить таймер для %s: %s", user_id, e)
+                return
+        except TelegramAPIError as e:
+            logger.warning("Не удалось обновить таймер для %s (возможно, сообщение удалено): %s", user_id, e)
+            return
+        self.schedule_timer_update(user_id, verification_data)
 
     async def handle_message_from_new_member(self, message: types.Message):
         """Обработка сообщений от участников"""
@@ -352,21 +708,20 @@ class VerificationBot:
 
         # Если HTest включен и пользователь на верификации, его сообщения нужно удалять, т.к. у него нет прав
         if self.htest_enabled and user_id in self.pending_verifications:
-            try:
-                await message.delete()
-                logger.info(f"Удалено сообщение от пользователя {user_id}, который находится на верификации.")
-            except TelegramAPIError as e:
-                logger.warning(f"Не удалось удалить сообщение от пользователя {user_id} на верификации: {e}")
-            return
+            logger.info("Удаляем сообщение от пользователя %s, который находится на верификации.", user_id)
+            return message.delete()  # Выполнит сам Telegram как ответ на вебхук
 
         # Если FastOut выключен, дальше не идем
         if not self.fastout_enabled:
             return
 
-        if user_id not in self.user_messages:
-            self.user_messages[user_id] = []
-        self.user_messages[user_id].append(message.message_id)
-        logger.debug(f"Сообщение от пользователя {user_id} в чате {message.chat.id} отслежено для FastOut.")
+        messages = self.user_messages.get(user_id)
+        if messages is None:
+            # Старые ID вытесняются из очереди: для FastOut важна только недавняя история
+            messages = self.user_messages[user_id] = deque(maxlen=self.config.max_messages_per_user)
+        messages.append((message.message_id, time.monotonic()))
+        self._touch(self.user_messages, user_id)
+        logger.debug("Сообщение от пользователя %s в чате %s отслежено для FastOut.", user_id, message.chat.id)
 
     async def on_left_chat_member(self, message: types.Message):
         """Обработка выхода участника через сервисное сообщение."""
@@ -374,15 +729,20 @@ class VerificationBot:
             return
         
         user = message.left_chat_member
-        if user.id in self.user_messages:
-            for message_id in self.user_messages[user.id]:
-                try:
-                    await self.bot.delete_message(chat_id=message.chat.id, message_id=message_id)
-                except TelegramAPIError as e:
-                    logger.error(f"Ошибка при удалении сообщения {message_id}: {e}")
-            del self.user_messages[user.id]
-            logger.info(f"Сообщения пользователя {user.id} удалены из чата {message.chat.id}")
-        await message.delete() # Удаляем сообщение "User left"
+        messages = self.user_messages.pop(user.id, None)
+        if messages:
+            # deleteMessages принимает до 100 ID за раз, пачки отправляем параллельно
+            message_ids = [message_id for message_id, _ in messages]
+            chunks = [message_ids[i:i + DELETE_MESSAGES_BATCH] for i in range(0, len(message_ids), DELETE_MESSAGES_BATCH)]
+            results = await asyncio.gather(
+                *(self._call(self.bot.delete_messages, chat_id=message.chat.id, message_ids=chunk) for chunk in chunks),
+                return_exceptions=True
+            )
+            for chunk, result in zip(chunks, results):
+                if isinstance(result, Exception):
+                    logger.error("Ошибка при удалении сообщений %s: %s", chunk, result)
+            logger.info("Сообщения пользователя %s удалены из чата %s", user.id, message.chat.id)
+        return message.delete() # Удаляем сообщение "User left" ответом на вебхук
 
     async def toggle_htest(self, message: types.Message):
         """Переключение механизма HTest"""
@@ -396,18 +756,18 @@ class VerificationBot:
         """Переключение механизмов проверки"""
         try:
             if not await self.is_admin(message.from_user.id, message.chat.id):
-                await message.reply("Только администраторы могут управлять настройками бота")
+                await self._send(message.chat.id, message.reply, "Только администраторы могут управлять настройками бота")
                 return
 
             args = message.text.split()
             if len(args) < 2:
                 status = self.htest_enabled if mechanism == "htest" else self.fastout_enabled
-                await message.reply(f"Механизм {mechanism}: {'включен' if status else 'выключен'}")
+                await self._send(message.chat.id, message.reply, f"Механизм {mechanism}: {'включен' if status else 'выключен'}")
                 return
 
             action = args[1].lower()
             if action not in ["on", "off"]:
-                await message.reply(f"Используйте: /{mechanism} on|off")
+                await self._send(message.chat.id, message.reply, f"Используйте: /{mechanism} on|off")
                 return
 
             new_state = (action == "on")
@@ -416,11 +776,11 @@ class VerificationBot:
             else:
                 self.fastout_enabled = new_state
 
-            await message.reply(f"Механизм {mechanism} {'включен' if new_state else 'выключен'}")
-            logger.info(f"Механизм {mechanism} переключен на {action} пользователем {message.from_user.id}")
+            await self._send(message.chat.id, message.reply, f"Механизм {mechanism} {'включен' if new_state else 'выключен'}")
+            logger.info("Механизм %s переключен на %s пользователем %s", mechanism, action, message.from_user.id)
 
         except TelegramAPIError as e:
-            logger.error(f"Ошибка при обработке команды /{mechanism} от {message.from_user.id}: {e}")
+            logger.error("Ошибка при обработке команды /%s от %s: %s", mechanism, message.from_user.id, e)
 
     async def show_status(self, message: types.Message):
         """Показ статуса бота"""
@@ -437,63 +797,58 @@ class VerificationBot:
 • Ожидают верификации: {len(self.pending_verifications)}
 • Отслеживаемые пользователи: {len(self.user_messages)}
         """
-        logger.info(f"Статус бота запрошен пользователем {message.from_user.id} в чате {message.chat.id}")
+        logger.info("Статус бота запрошен пользователем %s в чате %s", message.from_user.id, message.chat.id)
         try:
-            await message.reply(status_text)
-            logger.info(f"Статус бота отправлен в чат {message.chat.id}")
+            await self._send(message.chat.id, message.reply, status_text)
+            logger.info("Статус бота отправлен в чат %s", message.chat.id)
         except TelegramAPIError as e:
-            logger.error(f"Ошибка при отправке статуса в чат {message.chat.id}: {e}")
+            logger.error("Ошибка при отправке статуса в чат %s: %s", message.chat.id, e)
 
     async def handle_ignore_callback(self, callback: types.CallbackQuery):
         """Обрабатывает нажатие на кнопку-таймер, ничего не делая."""
         await callback.answer(cache_time=60)
 
     async def is_admin(self, user_id: int, chat_id: int) -> bool:
-        """Проверка прав администратора"""
+        """Проверка прав администратора по кэшированному списку админов чата"""
+        cached = self._admin_cache.get(chat_id)
+        if cached and cached[1] > time.monotonic():
+            return user_id in cached[0]
+
         try:
-            chat_member = await self.bot.get_chat_member(chat_id=chat_id, user_id=user_id)
-            return chat_member.status in [ChatMemberStatus.CREATOR, ChatMemberStatus.ADMINISTRATOR]
+            # Один запрос возвращает всех админов чата, что покрывает проверки для любых пользователей
+            administrators = await self._call(self.bot.get_chat_administrators, chat_id=chat_id)
         except TelegramAPIError as e:
-            logger.error(f"Ошибка при проверке прав админа для {user_id} в чате {chat_id}: {e}")
+            logger.error("Ошибка при получении списка админов чата %s для проверки %s: %s", chat_id, user_id, e)
             return False
 
-# Настройка вебхука
-async def on_startup(bot_instance: VerificationBot):
-    """Установка вебхука при запуске"""
-    try:
-        await bot_instance.bot.delete_webhook(drop_pending_updates=True)
-        await bot_instance.bot.set_webhook(bot_instance.config.webhook_url, allowed_updates=["message", "callback_query", "poll_answer", "chat_member"])
-        logger.info(f"Вебхук установлен: {bot_instance.config.webhook_url}")
-        webhook_info = await bot_instance.bot.get_webhook_info()
-        logger.info(f"Информация о вебхуке: {webhook_info}")
-    except Exception as e:
-        logger.error(f"Ошибка установки вебхука: {e}")
+        admin_ids = {member.user.id for member in administrators}
+        self._admin_cache.pop(chat_id, None)
+        self._admin_cache[chat_id] = (admin_ids, time.monotonic() + self.config.admin_cache_ttl)
+        return user_id in admin_ids
 
-async def on_shutdown(app):
-    """Очистка при остановке"""
-    try:
-        await app['bot'].bot.delete_webhook(drop_pending_updates=True)
-        await app['bot'].bot.session.close()
-        logger.info("Бот остановлен, вебхук удалён")
-    except Exception as e:
-        logger.error(f"Ошибка при остановке: {e}")
+# Тела ответов информационных GET-запросов кодируются один раз при загрузке модуля
+HEALTH_BODY = "Бот работает!".encode("utf-8")
+WEBHOOK_INFO_BODY = b"Webhook is active and waiting for POST requests from Telegram."
 
-# Обработчик вебхука
-async def webhook_handler(request):
-    """Обработка входящих POST-запросов от Telegram."""
-    try:
-        data = await request.json()
-        logger.debug(f"Данные вебхука: {data}")
-        update = types.Update(**data)
-        await request.app['bot'].dp.feed_update(request.app['bot'].bot, update)
-        return web.json_response({"status": "ok"})
-    except Exception as e:
-        logger.error(f"Ошибка при обработке вебхука: {e}")
-        return web.json_response({"status": "error", "message": str(e)}, status=500)
+async def health_handler(request):
+    """Проверка работоспособности для хостинга"""
+    return web.Response(body=HEALTH_BODY, content_type="text/plain", charset="utf-8")
+
+async def webhook_info_handler(request):
+    """Информационный ответ на GET-запрос к пути вебхука"""
+    return web.Response(body=WEBHOOK_INFO_BODY, content_type="text/plain", charset="utf-8")
 
 # Запуск приложения
 async def main():
     """Основная функция запуска"""
+    log_listener = setup_logging()
+    try:
+        await run_bot()
+    finally:
+        log_listener.stop()
+
+async def run_bot():
+    """Запуск веб-сервера и бота"""
     bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
     if not bot_token:
         logger.error("TELEGRAM_BOT_TOKEN не установлен!")
@@ -510,32 +865,50 @@ async def main():
         web_server_port=int(os.getenv("PORT", 5000)) # Для совместимости с Heroku/Railway
     )
 
-    logger.info(f"Полный URL вебхука для установки: {config.webhook_url}")
+    logger.info("Полный URL вебхука для установки: %s", config.webhook_url)
 
     bot_instance = VerificationBot(config)
 
     app = web.Application()
-    app['bot'] = bot_instance
-    # Регистрируем обработчик для POST-запросов от Telegram
-    app.router.add_post(config.webhook_path, webhook_handler)
+    # Хуки запуска/остановки диспетчера регистрируем раньше обработчика вебхука,
+    # чтобы вебхук удалялся до закрытия сессии бота
+    setup_application(app, bot_instance.dp, bot=bot_instance.bot)
+    # Обработчик POST-запросов от Telegram. Обновление обрабатывается до ответа, чтобы метод,
+    # возвращённый обработчиком (например, удаление сообщения), ушёл в теле ответа на вебхук
+    # без отдельного запроса к Bot API. Если обработка затянется, aiogram сам переведёт её в фон.
+    SimpleRequestHandler(
+        dispatcher=bot_instance.dp,
+        bot=bot_instance.bot,
+        handle_in_background=False
+    ).register(app, path=config.webhook_path)
     # Добавляем информационный GET-обработчик для того же пути
-    app.router.add_get(config.webhook_path, lambda _: web.Response(text="Webhook is active and waiting for POST requests from Telegram."))
+    app.router.add_get(config.webhook_path, webhook_info_handler)
     # Корневой путь для проверки работоспособности
-    app.router.add_get("/", lambda _: web.Response(text="Бот работает!"))
-    app.on_startup.append(lambda app: on_startup(app['bot']))
-    app.on_cleanup.append(on_shutdown)
+    app.router.add_get("/", health_handler)
 
     runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, config.web_server_host, config.web_server_port)
     try:
+        await runner.setup()  # Вызывает хуки запуска диспетчера, в том числе запуск таймеров
+        site = web.TCPSite(runner, config.web_server_host, config.web_server_port)
         await site.start()
-        logger.info(f"Сервер запущен на {config.web_server_host}:{config.web_server_port}")
+        logger.info("Сервер запущен на %s:%s", config.web_server_host, config.web_server_port)
+        # Долгоживущие объекты (диспетчер, обработчики, константы) переносим в постоянное поколение,
+        # чтобы циклический сборщик мусора не обходил их при каждом проходе
+        gc.collect()
+        gc.freeze()
         await asyncio.Event().wait()  # Ждём бесконечно
     except Exception as e:
-        logger.error(f"Ошибка сервера: {e}")
+        logger.error("Ошибка сервера: %s", e)
     finally:
         await runner.cleanup()
+        # Хуки остановки не вызываются, если setup() не завершился, поэтому таймеры останавливаем и здесь
+        await bot_instance.stop_timers()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # uvloop заметно быстрее стандартного цикла событий, но недоступен на Windows
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
\ No newline at end of file